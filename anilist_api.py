@@ -1,11 +1,15 @@
+import hashlib
 import logging
+import sqlite3
 import time
-from collections import namedtuple
 from string import Template
-from typing import Dict, Generator, List, Union
-import json
+from typing import AsyncGenerator, Dict, List, Tuple, Union
 
-import requests
+import httpx
+import numpy as np
+import orjson
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 class AnilistRequestError(Exception):
     """Custom exception for Anilist API errors"""
@@ -19,35 +23,185 @@ class AnilistUserNotFound(Exception):
     """Custom exception for Anilist users not found"""
     pass
 
-AnimeEntry = namedtuple('AnimeEntry', ['mediaId', 'title_romaji', 'score'])
+class ResponseCache:
+    """
+    A persistent SQLite-backed cache of raw Anilist API responses with a time-to-live.
+
+    Responses older than the TTL are purged when the cache is opened, so the file only
+    holds what is still usable.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400):
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body BLOB NOT NULL, created_at REAL NOT NULL)')
+        self.conn.commit()
+        self.purge_expired()
+
+    @staticmethod
+    def make_key(query: str, variables: dict) -> str:
+        """
+        Returns the cache key for a query and its variables.
+        """
+        return hashlib.sha1(query.encode() + orjson.dumps(variables, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key: str, ttl: Union[float, None] = None) -> Union[bytes, None]:
+        """
+        Returns the cached response body for a key, or None if it is missing or older than the TTL.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        row = self.conn.execute('SELECT body, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or time.time() - row[1] > ttl:
+            return None
+        return row[0]
+
+    def set(self, key: str, body: bytes):
+        """
+        Stores a response body under a key.
+        """
+        self.conn.execute('INSERT OR REPLACE INTO responses (key, body, created_at) VALUES (?, ?, ?)', (key, body, time.time()))
+        self.conn.commit()
+
+    def purge_expired(self):
+        """
+        Deletes the responses older than the TTL.
+        """
+        self.conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
 
 class AnilistAPI:
     """
     A wrapper class for the Anilist GraphQL API.
+
+    The API is asynchronous so that many requests can be in flight at once. Requests are
+    multiplexed over HTTP/2 by an httpx.AsyncClient, which is created on first use unless
+    one is passed in. A client created here waits up to `timeout` seconds for a response,
+    and must be closed with `close()`, or by using the instance as an async context manager.
+
+    Successful responses are cached on disk for `cache_ttl` seconds so reruns do not
+    download the same data again. Pass `cache_path=None` to disable the cache.
     """
 
-    def __init__(self):
+    max_retries = 10
+
+    def __init__(self, max_rate: float = 90, time_period: float = 60,
+                 cache_path: Union[str, None] = '.anilist_cache.sqlite', cache_ttl: float = 86400,
+                 client: Union[httpx.AsyncClient, None] = None, timeout: float = 60):
         self.url = 'https://graphql.anilist.co'
-        self.last_request_time = 0
+        self.cache = ResponseCache(cache_path, cache_ttl) if cache_path is not None else None
+        # Token bucket shared by every coroutine using this instance, matching AniList's 90 requests/minute
+        self.limiter = AsyncLimiter(max_rate=max_rate, time_period=time_period)
+        self.client = client
+        self._owns_client = client is None
+        # Batched list queries can take well over httpx's default 5s to answer
+        self.timeout = httpx.Timeout(timeout, connect=10)
+        # Assembled query text, keyed by query shape, so repeated shapes reuse identical strings
+        self._completed_query_cache: Dict[Tuple[bool, int], str] = {}
+        self._planning_query_cache: Dict[Tuple[bool, int], str] = {}
+        self._completers_query_cache: Dict[int, str] = {}
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        # httpx logs every request at INFO, which would drown out the scripts' progress output
+        logging.getLogger('httpx').setLevel(logging.WARNING)
 
-    def _rate_limit(self):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Returns the shared HTTP client, creating it on first use.
+        """
+        if self.client is None or self.client.is_closed:
+            # One long-lived HTTP/2 connection carries many concurrent requests
+            limits = httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=75)
+            self.client = httpx.AsyncClient(http2=True, limits=limits, timeout=self.timeout)
+            self._owns_client = True
+        return self.client
+
+    async def close(self):
+        """
+        Closes the HTTP client (if this instance created it) and the response cache.
+        """
+        if self.client is not None and self._owns_client:
+            await self.client.aclose()
+            self.client = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Union[float, None]:
+        """
+        Returns the number of seconds requested by a Retry-After header, if present.
+        """
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is None:
+            return None
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            return None
+
+    def _retry_wait(self, retry_state: RetryCallState) -> float:
+        """
+        Returns how long to wait before retrying: the server's Retry-After on HTTP 429,
+        otherwise an exponential backoff (5s, 10s, 20s, ... capped at 5 minutes).
+        """
+        error = retry_state.outcome.exception()
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            retry_after = self._retry_after(error.response)
+            if retry_after is not None:
+                return retry_after
+        return wait_exponential(multiplier=2.5, min=5, max=300)(retry_state)
+
+    def _log_retry(self, retry_state: RetryCallState):
         """
-        Ensures that requests are made no more frequently than once per second.
+        Logs a failed attempt that is about to be retried.
         """
-        current_time = time.time()
-        if current_time - self.last_request_time < 1:
-            time.sleep(1 - (current_time - self.last_request_time))
-        self.last_request_time = time.time()
+        error = retry_state.outcome.exception()
+        error_msg_parts = [
+            f"Request failed. Retrying in {retry_state.next_action.sleep:.0f} seconds...",
+            f"Error: {error!r}",
+        ]
+        if isinstance(error, httpx.HTTPStatusError):
+            response = error.response
+            error_msg_parts += [
+                f"Status Code: {response.status_code}",
+                f"Response Body: {response.content[:500].decode(errors='replace')}...",  # Truncate long responses
+                "Response Headers:",
+                *[f"  {header}: {value}" for header, value in response.headers.items()]
+            ]
+        self.logger.warning("\n".join(error_msg_parts))
+
+    async def _post(self, payload: bytes, variables: dict) -> Tuple[dict, bytes]:
+        """
+        Sends a single rate-limited request.
 
-    def _make_request(self, query: str, variables: dict) -> dict:
+        Returns:
+            Tuple[dict, bytes]: The decoded JSON response and its raw body.
+        """
+        async with self.limiter:
+            response = await self._get_client().post(self.url, content=payload, headers={'Content-Type': 'application/json'})
+        if response.status_code == 404:
+            self._raise_for_user_error(response.content, variables)
+        response.raise_for_status()
+        return orjson.loads(response.content), response.content
+
+    async def _make_request(self, query: str, variables: dict, cache_ttl: Union[float, None] = None) -> dict:
         """
-        Makes a rate-limited request to the Anilist GraphQL API.
+        Makes a rate-limited request to the Anilist GraphQL API, or returns a cached response.
 
         Args:
             query (str): The GraphQL query string.
             variables (dict): The variables for the query.
+            cache_ttl (float, optional): Maximum age in seconds of a usable cached response.
+                Defaults to the cache's TTL.
 
         Returns:
             dict: The JSON response from the API.
@@ -57,79 +211,59 @@ class AnilistAPI:
             AnilistPrivateUser: If one of the users in the batch is private.
             AnilistUserNotFound: If one of the users in the batch is not found.
         """
-        max_retries = 10
-        for attempt in range(max_retries):
-            self._rate_limit()
-            try:
-                response = requests.post(self.url, json={'query': query, 'variables': variables})
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.RequestException as e:
-                if response.status_code == 404:
-                    try:
-                        data = response.json()
-                    except json.JSONDecodeError:
-                        pass  # If it's not a JSON response, it's not our specific error
-
-                    if 'errors' in data:
-                        error_message = data['errors'][0].get('message', '')
-                        if error_message == 'Private User':
-                            users_in_batch = [value for key, value in variables.items() if key.startswith(('username', 'id'))]
-                            raise AnilistPrivateUser(f"One of the users provided in the batch {users_in_batch} is private")
-                        elif error_message == 'User not found':
-                            users_in_batch = [value for key, value in variables.items() if key.startswith(('username', 'id'))]
-                            raise AnilistUserNotFound(f"One of the users provided in the batch {users_in_batch} was not found")
-
-                wait_time = 60 * (attempt + 1)  # Backoff strategy: 60s, 120s, 180s, ...
-                
-                error_msg_parts = [
-                    f"Request failed. Retrying in {wait_time} seconds...",
-                    f"Error: {str(e)}",
-                    f"Status Code: {response.status_code}",
-                    f"Response Body: {response.text[:500]}...",  # Truncate long responses
-                    "Response Headers:",
-                    *[f"  {header}: {value}" for header, value in response.headers.items()]
-                ]
-                error_msg = "\n".join(error_msg_parts)
-
-                if attempt < max_retries - 1:
-                    self.logger.warning(error_msg)
-                    time.sleep(wait_time)
-                else:
-                    self.logger.exception(error_msg)
-                    raise AnilistRequestError(f"Failed to make request to Anilist API after {max_retries} attempts: {str(e)}") from e
-
-        raise AnilistRequestError(f"Max retries ({max_retries}) reached")
-
-    def fetchCompletedAnime(self, usernames: Union[str, List[str]] = None, userids: Union[int, List[int]] = None) -> Dict[str, List[AnimeEntry]]:
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(query, variables)
+            cached = self.cache.get(cache_key, cache_ttl)
+            if cached is not None:
+                return orjson.loads(cached)
+
+        payload = orjson.dumps({'query': query, 'variables': variables})
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.max_retries),
+            wait=self._retry_wait,
+            retry=retry_if_exception_type((httpx.HTTPError, orjson.JSONDecodeError)),
+            before_sleep=self._log_retry,
+            reraise=True
+        )
+        try:
+            data, response_body = await retrying(self._post, payload, variables)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+            self.logger.exception(f"Request failed after {self.max_retries} attempts")
+            raise AnilistRequestError(f"Failed to make request to Anilist API after {self.max_retries} attempts: {e!r}") from e
+
+        if cache_key is not None:
+            self.cache.set(cache_key, response_body)
+        return data
+
+    @staticmethod
+    def _raise_for_user_error(response_body: bytes, variables: dict):
         """
-        Fetches all completed anime scores for one or more users.
+        Raises the matching exception if a 404 response reports a private or missing user.
 
         Args:
-            usernames (Union[str, List[str]], optional): The username(s) to fetch data for.
-            userids (Union[int, List[int]], optional): The user ID(s) to fetch data for.
-
-        Returns:
-            Dict[str, List]: A dictionary where keys are usernames/ids and values are lists of AnimeEntry namedtuples.
+            response_body (bytes): The body of the 404 response.
+            variables (dict): The variables of the failed query.
 
         Raises:
-            ValueError: If neither usernames nor userids are provided, or if both are provided.
-            AnilistRequestError: If there's an error in the API response.
-            AnilistPrivateUser: If one of the users is private.
-            AnilistUserNotFound: If one of the users is not found.
+            AnilistPrivateUser: If one of the users in the batch is private.
+            AnilistUserNotFound: If one of the users in the batch is not found.
         """
-        if (usernames is None and userids is None) or (usernames is not None and userids is not None):
-            raise ValueError("Either usernames or userids must be provided, but not both.")
-
-        if isinstance(usernames, str):
-            usernames = [usernames]
-        if isinstance(userids, int):
-            userids = [userids]
-
-        users = usernames or userids
-        is_username = usernames is not None
-
-        fragment = '''
+        try:
+            data = orjson.loads(response_body)
+        except orjson.JSONDecodeError:
+            return  # If it's not a JSON response, it's not our specific error
+
+        if 'errors' in data:
+            error_message = data['errors'][0].get('message', '')
+            if error_message == 'Private User':
+                users_in_batch = [value for key, value in variables.items() if key.startswith(('username', 'id'))]
+                raise AnilistPrivateUser(f"One of the users provided in the batch {users_in_batch} is private")
+            elif error_message == 'User not found':
+                users_in_batch = [value for key, value in variables.items() if key.startswith(('username', 'id'))]
+                raise AnilistUserNotFound(f"One of the users provided in the batch {users_in_batch} was not found")
+
+    _COMPLETED_FRAGMENT = '''
         fragment MLG on MediaListGroup {
           entries {
             mediaId
@@ -143,6 +277,34 @@ class AnilistAPI:
         }
         '''
 
+    _PLANNING_FRAGMENT = '''
+        fragment MLG on MediaListGroup {
+          entries {
+            mediaId
+            media {
+              title {
+                romaji
+              }
+            }
+          }
+        }
+        '''
+
+    @staticmethod
+    def _build_user_lists_query(fragment: str, list_args: str, is_username: bool, n_users: int) -> str:
+        """
+        Builds a query that fetches one anime list per user for a batch of users.
+
+        Args:
+            fragment (str): Definition of the MLG fragment selecting the entry fields.
+            list_args (str): Extra MediaListCollection arguments, e.g. the list status.
+            is_username (bool): Whether users are identified by username rather than ID.
+            n_users (int): The number of users in the batch.
+
+        Returns:
+            str: A query with one aliased MediaListCollection per user (u1, u2, ...)
+                taking the variables $username1, $username2, ... or $id1, $id2, ...
+        """
         query_template = Template('''
         query UserAnime(${vars}) {
           ${sub_queries}
@@ -150,7 +312,7 @@ class AnilistAPI:
         ''')
 
         sub_query_template = Template('''
-        u${index}: MediaListCollection(${user_param}: $$${var_name}, type: ANIME, forceSingleCompletedList: true, status: COMPLETED) {
+        u${index}: MediaListCollection(${user_param}: $$${var_name}, type: ANIME, ${list_args}) {
           lists {
             ...MLG
           }
@@ -158,120 +320,168 @@ class AnilistAPI:
         ''')
 
         sub_queries = []
-        variables = {}
         var_declarations = []
 
-        for i, user in enumerate(users, 1):
+        for i in range(1, n_users + 1):
             var_name = f"{'username' if is_username else 'id'}{i}"
             var_type = 'String' if is_username else 'Int'
             var_declarations.append(f"${var_name}: {var_type}")
-            
+
             sub_query = sub_query_template.substitute(
                 index=i,
                 user_param="userName" if is_username else "userId",
-                var_name=var_name
+                var_name=var_name,
+                list_args=list_args
             )
             sub_queries.append(sub_query)
-            variables[var_name] = user
 
         query = query_template.substitute(
             vars=', '.join(var_declarations),
             sub_queries='\n'.join(sub_queries)
         )
 
-        query = fragment + query
+        return fragment + query
 
-        response = self._make_request(query, variables)
+    @staticmethod
+    def _resolve_users(usernames: Union[str, List[str], None], userids: Union[int, List[int], None]) -> Tuple[list, bool]:
+        """
+        Validates the usernames/userids arguments of the batched fetch methods.
 
-        result = {}
+        Returns:
+            Tuple[list, bool]: The list of users and whether they are usernames.
 
+        Raises:
+            ValueError: If neither usernames nor userids are provided, or if both are provided.
+        """
+        if (usernames is None and userids is None) or (usernames is not None and userids is not None):
+            raise ValueError("Either usernames or userids must be provided, but not both.")
+
+        if isinstance(usernames, str):
+            usernames = [usernames]
+        if isinstance(userids, int):
+            userids = [userids]
+
+        return usernames or userids, usernames is not None
+
+    async def _fetch_user_lists(self, query_cache: dict, fragment: str, list_args: str,
+                                usernames: Union[str, List[str], None], userids: Union[int, List[int], None],
+                                cache_ttl: Union[float, None] = None) -> dict:
+        """
+        Fetches one anime list per user with a single batched request.
+
+        Returns:
+            dict: A dictionary where keys are usernames/ids and values are the user's
+                MediaListCollection data. Users with no data available are left out.
+        """
+        users, is_username = self._resolve_users(usernames, userids)
+
+        query_key = (is_username, len(users))
+        query = query_cache.get(query_key)
+        if query is None:
+            query = query_cache[query_key] = self._build_user_lists_query(fragment, list_args, *query_key)
+
+        var_prefix = 'username' if is_username else 'id'
+        variables = {f"{var_prefix}{i}": user for i, user in enumerate(users, 1)}
+
+        response = await self._make_request(query, variables, cache_ttl)
+
+        result = {}
         for i, user in enumerate(users, 1):
             user_data = response['data'][f'u{i}']
             if user_data is None:
                 self.logger.warning(f"No data available for user {user}. They might be private or not found.")
                 continue
-            entries = []
-            for list_entry in user_data['lists']:
-                for entry in list_entry['entries']:
-                    entries.append(AnimeEntry(
-                        mediaId=entry['mediaId'],
-                        title_romaji=entry['media']['title']['romaji'],
-                        score=entry['score']
-                    ))
-            result[user] = entries
+            result[user] = user_data
 
         return result
 
-    def fetchPlanningAnime(self, userid: Union[int, None] = None, username: Union[str, None] = None) -> Dict[int, str]:
+    async def fetchCompletedAnime(self, usernames: Union[str, List[str]] = None, userids: Union[int, List[int]] = None,
+                                  cache_ttl: Union[float, None] = None) -> Dict[Union[str, int], Dict[str, Union[np.ndarray, List[str]]]]:
         """
-        Fetches all anime in the planning list for a user.
+        Fetches all completed anime scores for one or more users.
 
         Args:
-            userid (int, optional): The user ID.
-            username (str, optional): The username.
+            usernames (Union[str, List[str]], optional): The username(s) to fetch data for.
+            userids (Union[int, List[int]], optional): The user ID(s) to fetch data for.
+            cache_ttl (float, optional): Maximum age in seconds of a usable cached response. Pass 0
+                to always fetch the current list. Defaults to the cache's TTL.
 
         Returns:
-            Dict[int, str]: A dictionary where keys are mediaIds and values are anime titles.
+            Dict[Union[str, int], Dict]: A dictionary where keys are usernames/ids and values are the user's
+                entries as parallel arrays: 'mediaId' (int32 ndarray), 'score' (int8 ndarray, POINT_100)
+                and 'titles' (list of romaji titles).
 
         Raises:
-            ValueError: If neither userid nor username are provided, or if both are provided.
+            ValueError: If neither usernames nor userids are provided, or if both are provided.
             AnilistRequestError: If there's an error in the API response.
-            AnilistPrivateUser: If the user's list is private.
-            AnilistUserNotFound: If the user is not found.
-        """
-        if (userid is None and username is None) or (userid is not None and username is not None):
-            raise ValueError("Either userid or username must be provided, but not both.")
-
-        query = '''
-        query UserAnime($id: Int, $username: String) {
-          MediaListCollection(userId: $id, userName: $username, type: ANIME, status: PLANNING) {
-            lists {
-              entries {
-                mediaId
-                media {
-                  title {
-                    romaji
-                  }
-                }
-              }
-            }
-          }
-        }
-        '''
-
-        variables = {}
-        if userid is not None:
-            variables['id'] = userid
-        else:
-            variables['username'] = username
+            AnilistPrivateUser: If one of the users is private.
+            AnilistUserNotFound: If one of the users is not found.
+        """
+        user_lists = await self._fetch_user_lists(
+            self._completed_query_cache, self._COMPLETED_FRAGMENT,
+            'forceSingleCompletedList: true, status: COMPLETED', usernames, userids, cache_ttl
+        )
 
-        response = self._make_request(query, variables)
+        result = {}
 
-        planning_anime = {}
-        if response['data']['MediaListCollection'] is not None:
-            for lst in response['data']['MediaListCollection']['lists']:
-                for entry in lst['entries']:
-                    planning_anime[entry['mediaId']] = entry['media']['title']['romaji']
+        for user, user_data in user_lists.items():
+            entries = [entry for list_entry in user_data['lists'] for entry in list_entry['entries']]
+            result[user] = {
+                'mediaId': np.fromiter((entry['mediaId'] for entry in entries), dtype=np.int32, count=len(entries)),
+                'score': np.fromiter((entry['score'] for entry in entries), dtype=np.int8, count=len(entries)),
+                'titles': [entry['media']['title']['romaji'] for entry in entries],
+            }
 
-        return planning_anime
+        return result
 
-    
-    def fetchAnimeCompleters(self, mediaId: int, pages_per_query: int = 5) -> Generator[int, None, None]:
+    async def fetchPlanningAnime(self, usernames: Union[str, List[str]] = None, userids: Union[int, List[int]] = None,
+                                 cache_ttl: Union[float, None] = None) -> Dict[Union[str, int], Dict[int, str]]:
         """
-        Finds all users that have completed an anime with the given mediaId.
+        Fetches all anime in the planning list for one or more users.
 
         Args:
-            mediaId (int): The ID of the anime.
-            pages_per_query (int): Number of pages to fetch in a single query.
+            usernames (Union[str, List[str]], optional): The username(s) to fetch data for.
+            userids (Union[int, List[int]], optional): The user ID(s) to fetch data for.
+            cache_ttl (float, optional): Maximum age in seconds of a usable cached response. Pass 0
+                to always fetch the current list. Defaults to the cache's TTL.
 
-        Yields:
-            int: User IDs of users who have completed the anime and given it a non-zero score.
+        Returns:
+            Dict[Union[str, int], Dict[int, str]]: A dictionary where keys are usernames/ids and values
+                map mediaIds to anime titles.
 
         Raises:
+            ValueError: If neither usernames nor userids are provided, or if both are provided.
             AnilistRequestError: If there's an error in the API response.
+            AnilistPrivateUser: If one of the users is private.
+            AnilistUserNotFound: If one of the users is not found.
+        """
+        user_lists = await self._fetch_user_lists(
+            self._planning_query_cache, self._PLANNING_FRAGMENT, 'status: PLANNING', usernames, userids, cache_ttl
+        )
+
+        return {
+            user: {
+                entry['mediaId']: entry['media']['title']['romaji']
+                for lst in user_data['lists']
+                for entry in lst['entries']
+            }
+            for user, user_data in user_lists.items()
+        }
+
+    @staticmethod
+    def _build_completers_query(pages_per_query: int) -> str:
+        """
+        Builds the query text used by fetchAnimeCompleters.
+
+        Args:
+            pages_per_query (int): Number of pages fetched by a single query.
+
+        Returns:
+            str: A query with one aliased Page per page (p1, p2, ...) taking the
+                variables $page1, $page2, ...
         """
         query_template = Template('''
-        query MediaCompleters($mediaID: Int, $perPage: Int, ${page_vars}) {
+        query MediaCompleters($$mediaID: Int, $$perPage: Int, ${page_vars}) {
           ${page_queries}
         }
 
@@ -280,41 +490,58 @@ class AnilistAPI:
             currentPage
             hasNextPage
           }
-          mediaList(mediaId: $mediaID, status: COMPLETED) {
+          mediaList(mediaId: $$mediaID, status: COMPLETED) {
             userId
             score(format: POINT_100)
           }
         }
         ''')
 
+        page_vars = []
+        page_queries = []
+
+        for i in range(1, pages_per_query + 1):
+            page_vars.append(f'$page{i}: Int')
+            page_queries.append(f'p{i}: Page(page: $page{i}, perPage: $perPage) {{...mediaListFragment}}')
+
+        return query_template.substitute(
+            page_vars=', '.join(page_vars),
+            page_queries='\n'.join(page_queries)
+        )
+
+    async def fetchAnimeCompleters(self, mediaId: int, pages_per_query: int = 5) -> AsyncGenerator[int, None]:
+        """
+        Finds all users that have completed an anime with the given mediaId.
+
+        Args:
+            mediaId (int): The ID of the anime.
+            pages_per_query (int): Number of pages to fetch in a single query.
+
+        Yields:
+            int: User IDs of users who have completed the anime and given it a non-zero score.
+
+        Raises:
+            AnilistRequestError: If there's an error in the API response.
+        """
+        query = self._completers_query_cache.get(pages_per_query)
+        if query is None:
+            query = self._completers_query_cache[pages_per_query] = self._build_completers_query(pages_per_query)
+
         page = 1
         while True:
-            # Prepare variables and page queries for the current batch
+            # Prepare variables for the current batch; p1 fetches `page`, p2 fetches `page + 1`, ...
             variables = {'mediaID': mediaId, 'perPage': 50}
-            page_vars = []
-            page_queries = []
-            
-            for i in range(pages_per_query):
-                current_page = page + i
-                page_vars.append(f'page{current_page}: Int')
-                page_queries.append(f'p{current_page}: Page(page: $page{current_page}, perPage: $perPage) {{...mediaListFragment}}')
-                variables[f'page{current_page}'] = current_page
-
-            # Construct the full query
-            query = query_template.substitute(
-                page_vars=', '.join(page_vars),
-                page_queries='\n'.join(page_queries)
-            )
+            for i in range(1, pages_per_query + 1):
+                variables[f'page{i}'] = page + i - 1
 
             # Make the request
-            response = self._make_request(query, variables)
+            response = await self._make_request(query, variables)
 
             # Process the response
             has_next_page = False
-            for i in range(pages_per_query):
-                current_page = page + i
-                page_data = response['data'][f'p{current_page}']
-                
+            for i in range(1, pages_per_query + 1):
+                page_data = response['data'][f'p{i}']
+
                 if page_data is None:
                     break
 
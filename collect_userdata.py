@@ -1,114 +1,265 @@
 import argparse
-import json
+import asyncio
 import logging
-import math
-from collections import defaultdict
+import os
+import numpy as np
+import orjson
+import pandas as pd
+import jsonl_log
 from anilist_api import AnilistAPI, AnilistRequestError, AnilistPrivateUser, AnilistUserNotFound
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def fetch_and_store_ratings(user_ids, api, batch_size):
+# Ratings are kept as parallel columns of (user, anime, score) triples
+RATING_COLUMNS = {'user_id': np.int32, 'media_id': np.int32, 'score': np.int8}
+
+def concat_ratings(parts):
     """
-    Fetch anime ratings for given user IDs in batches and store them in the required format.
+    Concatenate rating columns into a single set of columns.
 
     Args:
-        user_ids (list): List of user IDs to fetch data for.
+        parts (list): Dicts mapping each column in RATING_COLUMNS to an array.
+
+    Returns:
+        dict: Column name to numpy array.
+    """
+    return {
+        column: np.concatenate([np.empty(0, dtype)] + [part[column] for part in parts]).astype(dtype, copy=False)
+        for column, dtype in RATING_COLUMNS.items()
+    }
+
+def batch_to_ratings(batch_anime):
+    """
+    Convert the result of AnilistAPI.fetchCompletedAnime into rating columns.
+
+    Args:
+        batch_anime (dict): User ID to that user's completed anime arrays.
+
+    Returns:
+        dict: Column name to numpy array.
+    """
+    return concat_ratings([
+        {
+            'user_id': np.full(len(user_anime['mediaId']), user_id, dtype=np.int32),
+            'media_id': user_anime['mediaId'],
+            'score': user_anime['score'],
+        }
+        for user_id, user_anime in batch_anime.items()
+    ])
+
+async def fetch_batch(user_ids, api, batch_num, total_batches, semaphore):
+    """
+    Fetch completed anime for a single batch of users once a concurrency slot is free.
+
+    Args:
+        user_ids (list): The user IDs in this batch.
         api (AnilistAPI): Instance of AnilistAPI to make API calls.
-        batch_size (int): Number of users to process in each batch.
+        batch_num (int): Index of this batch.
+        total_batches (int): Total number of batches, for logging.
+        semaphore (asyncio.Semaphore): Limits how many batches are in flight at once.
 
-    Yields:
-        tuple: (ratings dict, remaining users list, last completed batch number)
-    """
-    ratings = defaultdict(list)
-    total_batches = math.ceil(len(user_ids) / batch_size)
-    
-    for batch_num in range(total_batches):
-        start_idx = batch_num * batch_size
-        end_idx = min((batch_num + 1) * batch_size, len(user_ids))
-        batch = user_ids[start_idx:end_idx]
-
-        logger.info(f"Processing batch {batch_num + 1}/{total_batches} (Users {start_idx + 1}-{end_idx})")
-        
+    Returns:
+        tuple: (batch number, dict of user ID to completed anime arrays)
+    """
+    async with semaphore:
+        logger.info(f"Processing batch {batch_num + 1}/{total_batches} ({len(user_ids)} users)")
         try:
-            batch_anime = api.fetchCompletedAnime(userids=batch)
+            return batch_num, await api.fetchCompletedAnime(userids=user_ids)
         except (AnilistPrivateUser, AnilistUserNotFound) as e:
             logger.warning(f"Error in batch {batch_num + 1}: {str(e)}")
-            continue
-        except AnilistRequestError as e:
-            logger.exception(f"API error in batch {batch_num + 1}: {str(e)}")
-            return
+            return batch_num, {}
+
+async def fetch_and_store_ratings(user_ids, api, batch_size, concurrency=5):
+    """
+    Fetch anime ratings for given user IDs in batches and store them as rating columns.
+
+    Up to `concurrency` batches are requested at once; batches may complete out of order.
+
+    Args:
+        user_ids (list): List of user IDs to fetch data for.
+        api (AnilistAPI): Instance of AnilistAPI to make API calls.
+        batch_size (int): Number of users to process in each batch.
+        concurrency (int): Number of batches to request concurrently.
+
+    Yields:
+        tuple: (user IDs of the completed batch, ratings of that batch, number of completed batches)
+    """
+    batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+    total_batches = len(batches)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(fetch_batch(batch, api, batch_num, total_batches, semaphore))
+        for batch_num, batch in enumerate(batches)
+    ]
+
+    try:
+        for completed_batches, task in enumerate(asyncio.as_completed(tasks), 1):
+            try:
+                batch_num, batch_anime = await task
+            except AnilistRequestError as e:
+                logger.exception(f"API error after {completed_batches - 1} completed batches: {str(e)}")
+                return
 
-        for user_id, user_anime in batch_anime.items():
-            for anime in user_anime:
-                ratings[str(anime.mediaId)].append({str(user_id): anime.score})
+            yield batches[batch_num], batch_to_ratings(batch_anime), completed_batches
 
-        if (batch_num + 1) % 20 == 0 or batch_num == total_batches - 1:
-            remaining_users = user_ids[end_idx:]
-            logger.info(f"Processed batch {batch_num + 1}. {len(remaining_users)} users remaining.")
-            yield dict(ratings), remaining_users, batch_num
+            if completed_batches % 20 == 0:
+                logger.info(f"Processed {completed_batches}/{total_batches} batches.")
+    finally:
+        for task in tasks:
+            task.cancel()
 
 def load_checkpoint(checkpoint_file):
+    """
+    Replay a checkpoint log written by start_checkpoint and append_checkpoint.
+
+    An entry that cannot be decoded, e.g. one cut short by a crash, is skipped, so its
+    users are fetched again.
+
+    Returns:
+        tuple: (ratings columns, remaining users list, last batch number), or None on failure.
+    """
     try:
-        with open(checkpoint_file, 'r') as f:
-            checkpoint_data = json.load(f)
-        return (
-            defaultdict(list, checkpoint_data['ratings']),
-            checkpoint_data['remaining_users'],
-            checkpoint_data['last_batch']
-        )
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(checkpoint_file, 'rb') as f:
+            lines = f.read().splitlines()
+        user_ids = orjson.loads(lines[0])['user_ids']
+
+        done_users = set()
+        parts = []
+        last_batch = -1
+        for line in lines[1:]:
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                logger.warning(f"Skipping incomplete checkpoint entry in {checkpoint_file}")
+                continue
+            done_users.update(entry['users'])
+            parts.append({column: np.array(entry['rows'][column], dtype=dtype) for column, dtype in RATING_COLUMNS.items()})
+            last_batch = max(last_batch, entry['batch'])
+
+        remaining_users = [user for user in user_ids if user not in done_users]
+        return concat_ratings(parts), remaining_users, last_batch
+    except (FileNotFoundError, IndexError, orjson.JSONDecodeError, KeyError):
         logger.error(f"Failed to load checkpoint from {checkpoint_file}")
         return None
 
-def save_checkpoint(ratings, remaining_users, last_batch, checkpoint_file):
-    checkpoint_data = {
-        'ratings': dict(ratings),
-        'remaining_users': remaining_users,
-        'last_batch': last_batch
-    }
-    with open(checkpoint_file, 'w') as f:
-        json.dump(checkpoint_data, f)
+def start_checkpoint(user_ids, checkpoint_file):
+    """
+    Create a new checkpoint log for a list of users and return it open for appending.
+    """
+    f = open(checkpoint_file, 'wb')
+    f.write(orjson.dumps({'user_ids': user_ids}) + b'\n')
+    f.flush()
+    return f
+
+def resume_checkpoint(checkpoint_file):
+    """
+    Open an existing checkpoint log for appending.
+    """
+    return jsonl_log.open_for_append(checkpoint_file)
 
-def save_results(ratings, output_file):
-    with open(output_file, 'w') as f:
-        json.dump(ratings, f, indent=2)
+def append_checkpoint(f, batch_num, batch_users, batch_ratings):
+    """
+    Append one completed batch to a checkpoint log.
+
+    Each entry only holds that batch's ratings, so checkpointing costs O(batch size).
+    """
+    entry = {'batch': batch_num, 'users': batch_users, 'rows': batch_ratings}
+    f.write(orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY) + b'\n')
+    f.flush()
+
+def save_results(ratings, output_file, output_format='parquet'):
+    """
+    Save the collected ratings.
+
+    Args:
+        ratings (dict): Column name to numpy array, as built by concat_ratings.
+        output_file (str): Path of the output file.
+        output_format (str): 'parquet' for a user_id/media_id/score table, or 'json' for the
+            legacy {anime ID: [{user ID: score}, ...]} layout.
+    """
+    # Write to a temporary file first so an interrupted save never leaves a truncated output
+    tmp_file = f"{output_file}.tmp"
+    if output_format == 'json':
+        save_results_json(ratings, tmp_file)
+    else:
+        pd.DataFrame(ratings).to_parquet(tmp_file, compression='snappy', index=False)
+    os.replace(tmp_file, output_file)
+
+def save_results_json(ratings, output_file):
+    # Group the columns by anime into the {anime ID: [{user ID: score}, ...]} layout
+    order = np.argsort(ratings['media_id'], kind='stable')
+    media_ids = ratings['media_id'][order]
+    anime_ids, starts = np.unique(media_ids, return_index=True)
+    user_groups = np.split(ratings['user_id'][order], starts[1:])
+    score_groups = np.split(ratings['score'][order], starts[1:])
+
+    results = {
+        str(anime_id): [{str(user_id): score} for user_id, score in zip(users.tolist(), scores.tolist())]
+        for anime_id, users, scores in zip(anime_ids.tolist(), user_groups, score_groups)
+    }
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(results))
 
 def main():
     parser = argparse.ArgumentParser(description="Fetch and store anime ratings for a list of users")
-    input_group = parser.add_mutually_exclusive_group(required=True)
-    input_group.add_argument("--userid-list", help="JSON file containing list of user IDs")
-    input_group.add_argument("--checkpoint-file", help="File to load checkpoint data from and save to")
-    parser.add_argument("--ratings-out", default="ratings.json", help="Output file for storing ratings")
+    parser.add_argument("--userid-list", help="JSON file containing list of user IDs")
+    parser.add_argument("--checkpoint-file", help="Checkpoint log to resume from if it exists, and to append progress to")
+    parser.add_argument("--ratings-out", default="ratings.parquet", help="Output file for storing ratings")
+    parser.add_argument("--ratings-format", choices=["parquet", "json"], help="Format of the ratings output file (default: json for a .json file, otherwise parquet)")
     parser.add_argument("--batch-size", type=int, default=10, help="Number of users to process in each batch")
+    parser.add_argument("--concurrency", type=int, default=5, help="Number of batches to request concurrently")
     args = parser.parse_args()
+    if not args.userid_list and not args.checkpoint_file:
+        parser.error("at least one of --userid-list or --checkpoint-file is required")
 
-    # Initialize AnilistAPI
-    api = AnilistAPI()
+    # similarity.py picks the format from the extension, so the two must agree
+    extension_format = 'json' if args.ratings_out.endswith('.json') else 'parquet'
+    if args.ratings_format is None:
+        args.ratings_format = extension_format
+    elif args.ratings_format != extension_format:
+        parser.error(f"--ratings-format {args.ratings_format} does not match the extension of {args.ratings_out}")
 
+    asyncio.run(run(args))
+
+async def run(args):
     # Load initial data
-    if args.userid_list:
-        with open(args.userid_list, 'r') as f:
-            user_ids = json.load(f)
-        ratings = defaultdict(list)
-        last_batch = -1
-    else:
+    checkpoint = None
+    if args.checkpoint_file and os.path.exists(args.checkpoint_file):
         checkpoint_data = load_checkpoint(args.checkpoint_file)
         if checkpoint_data is None:
             logger.error("Failed to load checkpoint. Exiting.")
             return
         ratings, user_ids, last_batch = checkpoint_data
+        logger.info(f"Resuming from {args.checkpoint_file}: {len(user_ids)} users remaining")
+        checkpoint = resume_checkpoint(args.checkpoint_file)
+    elif args.userid_list:
+        with open(args.userid_list, 'rb') as f:
+            user_ids = orjson.loads(f.read())
+        ratings = concat_ratings([])
+        last_batch = -1
+        if args.checkpoint_file:
+            checkpoint = start_checkpoint(user_ids, args.checkpoint_file)
+    else:
+        logger.error(f"Checkpoint file {args.checkpoint_file} does not exist. Exiting.")
+        return
 
     # Fetch and store ratings
-    for updated_ratings, remaining_users, batch_num in fetch_and_store_ratings(user_ids, api, args.batch_size):
-        ratings.update(updated_ratings)
-        if args.checkpoint_file:
-            save_checkpoint(ratings, remaining_users, batch_num, args.checkpoint_file)
-            logger.info(f"Checkpoint saved at batch {batch_num + 1}")
+    ratings_parts = [ratings]
+    try:
+        async with AnilistAPI() as api:
+            async for batch_users, batch_ratings, completed_batches in fetch_and_store_ratings(user_ids, api, args.batch_size, args.concurrency):
+                ratings_parts.append(batch_ratings)
+                if checkpoint is not None:
+                    append_checkpoint(checkpoint, last_batch + completed_batches, batch_users, batch_ratings)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
 
     # Save final results
-    save_results(ratings, args.ratings_out)
+    save_results(concat_ratings(ratings_parts), args.ratings_out, args.ratings_format)
     logger.info(f"Completed. Ratings saved to {args.ratings_out}")
 
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
 import argparse
-import json
+import asyncio
+import os
 import time
 from collections import deque
+from contextlib import aclosing
+import orjson
+import jsonl_log
 from anilist_api import AnilistAPI
 
 def main():
@@ -9,60 +13,154 @@ def main():
     parser = argparse.ArgumentParser(description="Fetch Anilist users based on a seed username")
     parser.add_argument("username", help="The username to seed from")
     parser.add_argument("--n-others", type=int, default=100, help="The number of other users to fetch per anime")
+    parser.add_argument("--concurrency", type=int, default=8, help="The number of anime to fetch users for concurrently")
     parser.add_argument("--other-users-out", default="other_users.json", help="File to output the other users IDs")
+    parser.add_argument("--scanned-log", default="scanned_media_ids.jsonl", help="Log of anime already scanned, and their users, to skip on later runs")
     args = parser.parse_args()
 
-    # Initialize AnilistAPI
-    api = AnilistAPI()
+    asyncio.run(run(args))
 
-    # Fetch completed and planning anime for the seed user
-    user_completed = api.fetchCompletedAnime(usernames=args.username)[args.username]
-    user_planning = api.fetchPlanningAnime(username=args.username)
+async def run(args):
+    async with AnilistAPI() as api:
+        await collect_other_users(api, args)
 
-    # Merge the IDs from completed and planning anime into a single set
-    search_set = set(anime.mediaId for anime in user_completed)
+def load_scanned(scanned_log):
+    """
+    Replay the log of anime whose completers have already been fetched.
+
+    Args:
+        scanned_log (str): Path of the log written by append_scanned.
+
+    Returns:
+        dict: Anime ID to (list of user IDs found for it, whether that list holds all its completers).
+            A later entry for the same anime replaces an earlier one.
+    """
+    scanned = {}
+    if not os.path.exists(scanned_log):
+        return scanned
+
+    with open(scanned_log, 'rb') as f:
+        for line in f.read().splitlines():
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue  # An entry cut short by a crash; that anime is scanned again
+            scanned[entry['media_id']] = (entry['users'], entry.get('exhausted', False))
+    return scanned
+
+def append_scanned(f, anime_id, completers, exhausted):
+    """
+    Record that an anime has been scanned, together with the users found for it and
+    whether they are all of its completers.
+    """
+    f.write(orjson.dumps({'media_id': anime_id, 'users': completers, 'exhausted': exhausted}) + b'\n')
+    f.flush()
+
+def reusable_scans(scanned, search_set, n_others):
+    """
+    Select the logged scans that can stand in for fetching an anime's completers again.
+
+    A scan is reused only for anime in search_set, and only if it found at least n_others
+    users or every completer there is.
+
+    Returns:
+        dict: Anime ID to its first n_others logged user IDs.
+    """
+    return {
+        anime_id: users[:n_others]
+        for anime_id, (users, exhausted) in scanned.items()
+        if anime_id in search_set and (exhausted or len(users) >= n_others)
+    }
+
+async def fetch_anime_completers(api, anime_id, n_others, semaphore):
+    """
+    Fetch up to n_others IDs of users who completed and rated an anime.
+
+    Args:
+        api (AnilistAPI): Instance of AnilistAPI to make API calls.
+        anime_id (int): The ID of the anime.
+        n_others (int): The maximum number of user IDs to collect.
+        semaphore (asyncio.Semaphore): Limits how many anime are fetched concurrently.
+
+    Returns:
+        tuple: (anime ID, list of user IDs, whether the anime has no further completers)
+    """
+    completers = []
+    exhausted = True
+    async with semaphore:
+        async with aclosing(api.fetchAnimeCompleters(mediaId=anime_id)) as users:
+            async for other_user in users:
+                completers.append(other_user)
+                if len(completers) >= n_others:
+                    exhausted = False
+                    break
+    return anime_id, completers, exhausted
+
+async def collect_other_users(api, args):
+    # Fetch completed and planning anime for the seed user, bypassing the cache so recent changes are picked up
+    user_completed, user_planning = await asyncio.gather(
+        api.fetchCompletedAnime(usernames=args.username, cache_ttl=0),
+        api.fetchPlanningAnime(usernames=args.username, cache_ttl=0)
+    )
+    user_completed = user_completed[args.username]
+    user_planning = user_planning.get(args.username, {})
+
+    # Merge the IDs from completed and planning anime into a single list of unique IDs
+    title_by_id = dict(zip(user_completed['mediaId'].tolist(), user_completed['titles']))
+    search_set = set(title_by_id)
     search_set.update(user_planning.keys())
 
+    # Skip anime scanned by earlier runs, keeping the users found for them
+    reused = reusable_scans(load_scanned(args.scanned_log), search_set, args.n_others)
+    search_list = [anime_id for anime_id in search_set if anime_id not in reused]
+    total_anime = len(search_list)
+    if reused:
+        print(f"Skipping {len(reused)} anime already scanned in {args.scanned_log}")
+
     other_users = set()  # set of users that have also seen anime on our list
-    
+    for users in reused.values():
+        other_users.update(users)
+
     # Initialize time tracking
     iteration_times = deque(maxlen=10)
     start_time = time.time()
+    last_completion_time = start_time
+
+    # Fetch completers for several anime at once, bounded by the semaphore
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks = [
+        asyncio.create_task(fetch_anime_completers(api, anime_id, args.n_others, semaphore))
+        for anime_id in search_list
+    ]
+
+    try:
+        with jsonl_log.open_for_append(args.scanned_log) as scanned_file:
+            for i, task in enumerate(asyncio.as_completed(tasks), 1):
+                anime_id, completers, exhausted = await task
+                other_users.update(completers)
+                append_scanned(scanned_file, anime_id, completers, exhausted)
+
+                # Get the title from either completed or planning list
+                anime_title = title_by_id.get(anime_id) or user_planning.get(anime_id, "Unknown Title")
+
+                completion_time = time.time()
+                iteration_times.append(completion_time - last_completion_time)
+                last_completion_time = completion_time
+
+                # Calculate and print progress with time estimate
+                avg_iteration_time = sum(iteration_times) / len(iteration_times)
+                remaining_iterations = total_anime - i
+                estimated_time_remaining = (remaining_iterations * avg_iteration_time) / 60  # in minutes
 
-    for i, anime_id in enumerate(search_set, 1):
-        iteration_start = time.time()
-        
-        # Get the title from either completed or planning list
-        anime_title = next((anime.title_romaji for anime in user_completed if anime.mediaId == anime_id), 
-                           user_planning.get(anime_id, "Unknown Title"))
-        
-        users_added = 0
-        for j, other_user in enumerate(api.fetchAnimeCompleters(mediaId=anime_id), 1):
-            other_users.add(other_user)
-            users_added += 1
-            
-            # Print progress as whole number percentage
-            percentage = (users_added * 100) // args.n_others
-            if percentage > 0 and users_added % (args.n_others // 100) == 0:
-                print(f"  Processed {percentage}% of users for this anime")
-            
-            if users_added >= args.n_others:
-                break
-        
-        iteration_end = time.time()
-        iteration_times.append(iteration_end - iteration_start)
-        
-        # Calculate and print progress with time estimate
-        avg_iteration_time = sum(iteration_times) / len(iteration_times)
-        remaining_iterations = len(search_set) - i
-        estimated_time_remaining = (remaining_iterations * avg_iteration_time) / 60  # in minutes
-        
-        print(f"Progress: {i}/{len(search_set)} - Anime: {anime_title}")
-        print(f"Estimated time remaining: {estimated_time_remaining:.2f} minutes")
+                print(f"Progress: {i}/{total_anime} - Anime: {anime_title} ({len(completers)} users)")
+                print(f"Estimated time remaining: {estimated_time_remaining:.2f} minutes")
+    finally:
+        for task in tasks:
+            task.cancel()
 
     # Output other_users to the specified file as a JSON list
-    with open(args.other_users_out, 'w') as f:
-        json.dump(list(other_users), f)
+    with open(args.other_users_out, 'wb') as f:
+        f.write(orjson.dumps(list(other_users)))
 
     total_time = (time.time() - start_time) / 60  # in minutes
     print(f"Completed. Found {len(other_users)} unique users. Data saved to {args.other_users_out}")
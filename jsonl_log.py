@@ -0,0 +1,23 @@
+import os
+
+def open_for_append(path):
+    """
+    Open a JSON-lines log for appending, creating it if needed.
+
+    If the last entry was cut short by a crash it is terminated, so the next entry starts
+    on its own line and only the incomplete entry fails to decode when the log is replayed.
+
+    Returns:
+        The log opened in binary append mode.
+    """
+    f = open(path, 'ab+')
+    try:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    except BaseException:
+        f.close()
+        raise
+    return f
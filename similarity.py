@@ -1,137 +1,253 @@
+import asyncio
 import numpy as np
 import pandas as pd
-import json
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
+import orjson
+from collections import namedtuple
+from numba import njit, prange
+from sklearn.neighbors import NearestNeighbors
 from anilist_api import AnilistAPI, AnilistRequestError, AnilistPrivateUser, AnilistUserNotFound
 
 import argparse
 
+# Sparse item-item similarities: row i holds the similarities of item i's nearest neighbours,
+# and anime_ids labels both the rows and the columns
+ItemSimilarity = namedtuple('ItemSimilarity', ['matrix', 'anime_ids'])
 
-def normalize_ratings(df):
+def ratings_json_to_frame(ratings_data):
     """
-    Normalize the ratings by subtracting the mean rating of each user from their ratings.
+    Flatten ratings in the legacy JSON layout into a table of (user, anime, score) triples.
     
     Args:
-    df (pd.DataFrame): Input DataFrame where rows are users and columns are anime.
+    ratings_data (dict): Mapping of anime ID to a list of {user ID: score} dicts.
     
     Returns:
-    pd.DataFrame: Normalized DataFrame with the same shape as the input.
+    pd.DataFrame: Table with user_id, media_id and score columns.
+    """
+    return pd.DataFrame(
+        [(int(user_id), int(anime_id), score)
+         for anime_id, ratings in ratings_data.items()
+         for rating in ratings
+         for user_id, score in rating.items()],
+        columns=['user_id', 'media_id', 'score']
+    )
+
+def load_ratings(path):
     """
-    # Calculate the mean rating for each user
-    user_mean_ratings = df.mean(axis=1)
+    Load the ratings written by collect_userdata.py.
     
-    # Subtract the mean rating from each rating
-    normalized_df = df.sub(user_mean_ratings, axis=0)
+    Args:
+    path (str): A Parquet file, or a JSON file in the legacy layout.
     
-    return normalized_df
+    Returns:
+    pd.DataFrame: Table with user_id, media_id and score columns.
+    """
+    if path.endswith('.json'):
+        with open(path, 'rb') as file:
+            return ratings_json_to_frame(orjson.loads(file.read()))
+    return pd.read_parquet(path, columns=['user_id', 'media_id', 'score'])
 
-def cosine_similarity_matrix(df):
+def ratings_to_matrix(triples):
     """
-    Calculate the cosine similarity matrix for items based on their ratings.
+    Build a sparse rating matrix from a table of ratings.
     
     Args:
-    df (pd.DataFrame): Input DataFrame where rows are users and columns are items.
+    triples (pd.DataFrame): Table with user_id, media_id and score columns.
     
     Returns:
-    pd.DataFrame: Similarity matrix where both rows and columns represent items.
+    tuple: (sp.csr_matrix where rows are users and columns are anime,
+            pd.Index of user IDs for the rows, pd.Index of anime IDs for the columns)
     """
-    # Transpose the DataFrame to calculate similarity between items
-    df_transposed = df.T
+    # A user may appear more than once for the same anime; keep their latest score
+    triples = triples.drop_duplicates(['user_id', 'media_id'], keep='last')
+
+    # Factorize the IDs into sorted row and column positions
+    users = pd.Categorical(triples['user_id'])
+    anime = pd.Categorical(triples['media_id'])
+
+    matrix = sp.coo_matrix(
+        (triples['score'].to_numpy(dtype=np.float32), (users.codes, anime.codes)),
+        shape=(len(users.categories), len(anime.categories))
+    ).tocsr()
+
+    return matrix, pd.Index(users.categories), pd.Index(anime.categories)
+
+def normalize_ratings(ratings):
+    """
+    Normalize the ratings by subtracting the mean rating of each user from their ratings.
     
-    # Calculate cosine similarity
-    similarity = cosine_similarity(df_transposed)
+    Only stored ratings are shifted; missing ratings stay implicit zeros.
     
-    # Create a DataFrame from the similarity matrix
-    similarity_df = pd.DataFrame(similarity, index=df.columns, columns=df.columns)
+    Args:
+    ratings (sp.csr_matrix): Input matrix where rows are users and columns are anime.
     
-    return similarity_df
+    Returns:
+    sp.csr_matrix: Normalized matrix with the same shape and sparsity as the input.
+    """
+    # Scores are 0-100, so single precision is plenty and halves the memory traffic
+    normalized = ratings.tocsr().astype(np.float32)
+
+    # Calculate the mean rating for each user over the anime they have rated
+    counts = np.diff(normalized.indptr)
+    sums = np.asarray(normalized.sum(axis=1)).ravel()
+    user_mean_ratings = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+    # Subtract the mean rating from each rating
+    normalized.data -= np.repeat(user_mean_ratings, counts)
+
+    return normalized
 
-def predict_user_ratings(username, similarity_matrix, api: AnilistAPI):
+def cosine_similarity_matrix(ratings, anime_ids, n_neighbors=50):
+    """
+    Calculate the cosine similarities between each item and its nearest neighbours.
+    
+    Only the n_neighbors most similar items are kept per item, so memory grows with
+    the number of items rather than its square.
+    
+    Args:
+    ratings (sp.csr_matrix): Input matrix where rows are users and columns are items.
+    anime_ids (pd.Index): The item IDs of the columns.
+    n_neighbors (int): Number of most similar items (including the item itself) to keep per item.
+    
+    Returns:
+    ItemSimilarity: Sparse similarity matrix where both rows and columns represent items.
+    """
+    # Transpose the matrix to calculate similarity between items
+    items = ratings.T.tocsr().astype(np.float32, copy=False)
+    n_items = items.shape[0]
+    n_neighbors = min(n_neighbors, n_items)
+
+    nn = NearestNeighbors(n_neighbors=n_neighbors, metric='cosine').fit(items)
+    distances, neighbors = nn.kneighbors(items)
+
+    # Cosine distance is 1 - cosine similarity; every row has exactly n_neighbors entries
+    similarity = sp.csr_matrix(
+        ((1 - distances).astype(np.float32).ravel(), neighbors.ravel(), np.arange(0, n_items * n_neighbors + 1, n_neighbors)),
+        shape=(n_items, n_items)
+    )
+
+    return ItemSimilarity(similarity, anime_ids)
+
+# NaN marks missing similarities, so fastmath must not assume NaN-free inputs ('nnan')
+@njit(parallel=True, fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'}, cache=True)
+def predict_kernel(sim, scores, weighted):
+    """
+    Predict a rating for each planning anime from the user's completed scores.
+    
+    Args:
+    sim (np.ndarray): (planning x completed) float32 similarities, NaN where unknown.
+    scores (np.ndarray): float32 scores of the completed anime.
+    weighted (bool): Weight scores by similarity instead of averaging those with similarity >= 0.
+    
+    Returns:
+    np.ndarray: float32 predicted ratings, NaN where no completed anime contributes.
+    """
+    n_planning, n_completed = sim.shape
+    predicted = np.empty(n_planning, dtype=np.float32)
+    for j in prange(n_planning):
+        numerator = 0.0
+        denominator = 0.0
+        for i in range(n_completed):
+            v = sim[j, i]
+            if weighted:
+                if not np.isnan(v):
+                    numerator += v * scores[i]
+                    denominator += abs(v)
+            elif v >= 0:
+                numerator += scores[i]
+                denominator += 1.0
+        predicted[j] = numerator / denominator if denominator > 0 else np.nan
+    return predicted
+
+async def predict_user_ratings(username, similarity_matrix, api: AnilistAPI, weighted=False):
     """
     Predict ratings for a specified Anilist user's planning list.
     
+    By default a planning anime's prediction is the plain mean of the user's scores for the
+    completed anime with a non-negative similarity to it; the similarity only acts as a mask.
+    With weighted=True the scores are instead weighted by similarity, i.e. sum(sim * score) / sum(|sim|).
+    
     Args:
     username (str): The Anilist username.
-    similarity_matrix (pd.DataFrame): The item similarity matrix.
+    similarity_matrix (ItemSimilarity): The item similarity matrix.
     api (AnilistAPI): An instance of the AnilistAPI class.
+    weighted (bool): Weight each completed anime's score by its similarity.
     
     Returns:
     dict: A dictionary of predicted ratings for the user's planning list.
     """
     try:
-        planning = api.fetchPlanningAnime(username=username)
-        completed = api.fetchCompletedAnime(usernames=username)
+        planning, completed = await asyncio.gather(
+            # The user's own lists are always fetched fresh so recent changes are picked up
+            api.fetchPlanningAnime(usernames=username, cache_ttl=0),
+            api.fetchCompletedAnime(usernames=username, cache_ttl=0)
+        )
     except (AnilistRequestError, AnilistPrivateUser, AnilistUserNotFound) as e:
         print(f"Error fetching data for user {username}: {str(e)}")
         return {}
 
-    # Convert completed to a Series with anime id as index and score as value
-    completed = pd.Series({anime.mediaId: anime.score for anime in completed[username]})
+    planning = planning.get(username, {})
+    planning_ids = list(planning.keys())
+    completed_ids = completed[username]['mediaId']
+    scores = completed[username]['score'].astype(np.float32)
 
-    # Get the subset of the similarity matrix for completed anime and planning anime
-    all_anime_sim = similarity_matrix.loc[completed.index, list(planning.keys())]
+    # Get the (planning x completed) block of similarities from each planning anime's neighbours.
+    # Pairs that are not neighbours, or anime missing from the matrix, are NaN
+    completed_idx = similarity_matrix.anime_ids.get_indexer(completed_ids)
+    planning_idx = similarity_matrix.anime_ids.get_indexer(planning_ids)
+    known_completed = completed_idx >= 0
+    known_planning = planning_idx >= 0
 
-    predicted_ratings = {}
+    neighbours = similarity_matrix.matrix[planning_idx[known_planning]][:, completed_idx[known_completed]].tocoo()
+    known_sim = np.full((known_planning.sum(), known_completed.sum()), np.nan, dtype=np.float32)
+    known_sim[neighbours.row, neighbours.col] = neighbours.data
 
-    for planning_anime, title in planning.items():
-        planning_sim = all_anime_sim.loc[:, planning_anime] >= 0
-        if planning_sim.sum() > 0:  # Avoid division by zero
-            predicted_rating = (planning_sim * completed).sum() / planning_sim.sum()
-            predicted_ratings[planning_anime] = {
-                'title': title,
-                'predicted_rating': predicted_rating
-            }
-        else:
-            predicted_ratings[planning_anime] = {
-                'title': title,
-                'predicted_rating': None  # or some default value
-            }
+    sim = np.full((len(planning_ids), len(completed_ids)), np.nan, dtype=np.float32)
+    sim[np.ix_(known_planning, known_completed)] = known_sim
 
-    return predicted_ratings
+    predicted = predict_kernel(sim, scores, weighted)
 
-parser = argparse.ArgumentParser()
-parser.add_argument("username")
-parser.add_argument("--ratings", default="ratings.json")
-args = parser.parse_args()
+    return {
+        anime_id: {
+            'title': planning[anime_id],
+            'predicted_rating': None if np.isnan(rating) else float(rating)
+        }
+        for anime_id, rating in zip(planning_ids, predicted.tolist())
+    }
 
-api = AnilistAPI()
-
-# Load the ratings data from the JSON file
-with open(args.ratings, 'r') as file:
-    ratings_data = json.load(file)
-
-# Create a dictionary to store the data
-data_dict = {}
-
-# Iterate through the ratings data
-for anime_id, ratings in ratings_data.items():
-    for rating in ratings:
-        for user_id, score in rating.items():
-            if user_id not in data_dict:
-                data_dict[user_id] = {}
-            data_dict[user_id][anime_id] = score
-
-# Create a dataframe from the dictionary
-df = pd.DataFrame.from_dict(data_dict, orient='index')
+async def predict_with_api(username, similarity_matrix):
+    """
+    Predict ratings for a user's planning list using a short-lived AnilistAPI session.
+    
+    Args:
+    username (str): The Anilist username.
+    similarity_matrix (ItemSimilarity): The item similarity matrix.
+    
+    Returns:
+    dict: A dictionary of predicted ratings for the user's planning list.
+    """
+    async with AnilistAPI() as api:
+        return await predict_user_ratings(username, similarity_matrix, api)
 
-# Convert the index and columns to integers
-df.index = df.index.astype(int)
-df.columns = df.columns.astype(int)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("username")
+    parser.add_argument("--ratings", default="ratings.parquet", help="Ratings file (.parquet, or legacy .json)")
+    parser.add_argument("--neighbors", type=int, default=50, help="Number of most similar anime to keep per anime")
+    args = parser.parse_args()
 
-# Sort the index and columns
-df = df.sort_index()
-df = df.sort_index(axis=1)
+    # Load the ratings data
+    ratings, user_ids, anime_ids = ratings_to_matrix(load_ratings(args.ratings))
 
-# Print the first few rows and columns of the dataframe
-print(df.iloc[:5, :5])
+    # Print some basic information about the rating matrix
+    print(f"{len(user_ids)} users x {len(anime_ids)} anime, {ratings.nnz} ratings")
 
-# Print some basic information about the dataframe
-print(df.info())
+    # Print summary statistics of the scores
+    print(pd.Series(ratings.data).describe())
 
-# Print summary statistics of the dataframe
-print(df.describe())
+    norm = normalize_ratings(ratings)
+    sim = cosine_similarity_matrix(norm, anime_ids, args.neighbors)
+    predictions = asyncio.run(predict_with_api(args.username, sim))
 
-norm = normalize_ratings(df)
-norm = norm.fillna(0)
-sim = cosine_similarity_matrix(norm)
-predictions = predict_user_ratings(args.username, sim, api)
+if __name__ == "__main__":
+    main()